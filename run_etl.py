@@ -1,11 +1,16 @@
 import asyncio
+import csv
 import os
 import logging
+from io import StringIO
 from datetime import datetime
 from nhl_scraper import NHLScraper
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError
 import pandas as pd
+import psycopg2
+from sqlalchemy import (
+    Boolean, Date, DateTime, Float, Integer, Numeric, String, Time, create_engine, inspect, text,
+)
+from sqlalchemy.exc import DataError, SQLAlchemyError
 
 # Set up logging
 logging.basicConfig(
@@ -14,138 +19,280 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Cap on how many player ids are dumped per debug log line.
+MAX_LOGGED_IDS = 50
+
+# Stored procedures that move staging data into the live tables.
+SYNC_ROSTERS = text("CALL sync_rosters_from_staging()")
+SYNC_PLAYERS = text("CALL sync_players_from_staging()")
+SYNC_SEASON_SKATERS = text("CALL sync_season_skaters_from_staging()")
+SYNC_SEASON_GOALIES = text("CALL sync_season_goalies_from_staging()")
+SYNC_SKATERS = text("CALL sync_skaters_from_staging()")
+SYNC_GOALIES = text("CALL sync_goalies_from_staging()")
+
+# Player ids on the scraped rosters but not active, and vice versa.
+CALL_UPS = text(
+    'SELECT "playerId" FROM staging1.current_rosters '
+    'EXCEPT SELECT "playerId" FROM newapi.rosters_active'
+)
+SEND_DOWNS = text(
+    'SELECT "playerId" FROM newapi.rosters_active '
+    'EXCEPT SELECT "playerId" FROM staging1.current_rosters'
+)
+
+
+# Written for None so COPY keeps NULL distinct from an empty string, which an
+# unquoted empty CSV field would otherwise also load as.
+COPY_NULL = r'\N'
+
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """pandas ``to_sql`` method that bulk loads rows with PostgreSQL COPY."""
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        buf = StringIO()
+        csv.writer(buf).writerows(
+            [COPY_NULL if value is None else value for value in row] for row in data_iter
+        )
+        buf.seek(0)
+
+        columns = ', '.join(f'"{k}"' for k in keys)
+        if table.schema:
+            table_name = f'"{table.schema}"."{table.name}"'
+        else:
+            table_name = f'"{table.name}"'
+        cur.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buf,
+        )
+
+
+# pandas.api.types.infer_dtype results mapped to the column kind pandas' to_sql
+# would create for them. Anything not listed is created as TEXT.
+INFERRED_KINDS = {
+    'integer': 'int',
+    'floating': 'float',
+    'mixed-integer-float': 'float',
+    'decimal': 'float',
+    'boolean': 'bool',
+    'datetime64': 'datetime',
+    'datetime': 'datetime',
+    'date': 'date',
+    'time': 'time',
+}
+
+
+def sql_type_kind(sql_type):
+    """Return the column kind of a reflected SQLAlchemy type, or None if unknown."""
+    for type_class, kind in (
+        (Boolean, 'bool'),
+        (Integer, 'int'),
+        (Float, 'float'),
+        (Numeric, 'float'),
+        (DateTime, 'datetime'),
+        (Date, 'date'),
+        (Time, 'time'),
+        (String, 'text'),
+    ):
+        if isinstance(sql_type, type_class):
+            return kind
+    return None
+
+
+def is_integral(col):
+    """Whether every non-null value in a float column is a whole number."""
+    return bool((col.dropna() % 1 == 0).all())
+
+
+def staging_table_matches(df, column_types):
+    """Whether ``df`` can be loaded into a table with ``column_types`` as-is.
+
+    Column names must match, and each column's type must be what pandas would
+    infer for it on this run. Integral float columns (integers upcast by missing
+    values) also fit an integer column. All-null columns fit any type.
+    """
+    if set(column_types) != set(df.columns):
+        return False
+    for name, col_type in column_types.items():
+        col = df[name]
+        if not col.notna().any():
+            continue
+        table_kind = sql_type_kind(col_type)
+        frame_kind = INFERRED_KINDS.get(pd.api.types.infer_dtype(col, skipna=True), 'text')
+        if frame_kind == table_kind:
+            continue
+        if table_kind == 'int' and frame_kind == 'float' and is_integral(col):
+            continue
+        return False
+    return True
+
+
+def cast_integer_columns(df, column_types):
+    """Cast integral float columns to nullable Int64 where the table column is an integer.
+
+    pandas upcasts integer columns with missing values to float64, which COPY
+    would send as ``97.0`` and PostgreSQL rejects for an integer column.
+    """
+    casts = {}
+    for name, col_type in column_types.items():
+        col = df[name]
+        if isinstance(col_type, Integer) and col.dtype.kind == 'f' and is_integral(col):
+            casts[name] = 'Int64'
+    return df.astype(casts) if casts else df
+
+
+def replace_staging_table(conn, df, name, schema='staging1'):
+    """Replace the contents of a staging table with ``df``.
+
+    When the table's columns and types still match the frame it is truncated
+    and appended to, avoiding a DROP/CREATE per run. Otherwise, or if the
+    in-place load hits a data error, the table is recreated from the frame as
+    pandas would with ``if_exists='replace'``.
+    """
+    inspector = inspect(conn)
+    if inspector.has_table(name, schema=schema):
+        column_types = {c['name']: c['type'] for c in inspector.get_columns(name, schema=schema)}
+        if staging_table_matches(df, column_types):
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f'TRUNCATE TABLE "{schema}"."{name}"'))
+                    cast_integer_columns(df, column_types).to_sql(
+                        name, conn, schema=schema, if_exists='append', index=False,
+                        method=psql_insert_copy,
+                    )
+                return
+            except (DataError, psycopg2.DataError):
+                logger.warning("Data no longer fits %s.%s; recreating it", schema, name, exc_info=True)
+        else:
+            logger.warning("Columns of %s.%s no longer match the scraped data; recreating it",
+                           schema, name)
+    df.to_sql(name, conn, schema=schema, if_exists='replace', index=False, method=psql_insert_copy)
+
+
+def sync_rosters(engine, db_name, current_data):
+    """Stage the scraped rosters, diff them against active rosters and sync.
+
+    Runs in one transaction: the diff sees the uncommitted staging rows and runs
+    before sync_rosters_from_staging updates newapi.rosters_active, so that
+    table never has to be pulled back to the client.
+    Returns (call-up ids, send-down ids).
+    """
+    with engine.begin() as conn:
+        replace_staging_table(conn, current_data, 'current_rosters')
+
+        new_players = conn.execute(CALL_UPS).scalars().all()
+        missing_players = conn.execute(SEND_DOWNS).scalars().all()
+
+        logger.info("[%s]   - Syncing rosters...", db_name)
+        conn.execute(SYNC_ROSTERS)
+    return new_players, missing_players
+
+
+def sync_players_and_season_stats(engine, db_name, skaters_df, goalies_df, sync_players):
+    """Sync scraped player data, then stage and sync season stats, in one transaction.
+
+    Season stats are staged only after the player procedures have run, so the
+    scraper's staging output is consumed before those tables are replaced.
+    """
+    with engine.begin() as conn:
+        if sync_players:
+            logger.info("[%s]   - Syncing players...", db_name)
+            conn.execute(SYNC_PLAYERS)
+
+            logger.info("[%s]   - Syncing season skaters...", db_name)
+            conn.execute(SYNC_SEASON_SKATERS)
+
+            logger.info("[%s]   - Syncing season goalies...", db_name)
+            conn.execute(SYNC_SEASON_GOALIES)
+
+        logger.info("[%s]   - Loading season stats to staging...", db_name)
+        replace_staging_table(conn, skaters_df, 'skaters')
+        replace_staging_table(conn, goalies_df, 'goalies')
+
+        logger.info("[%s]   - Syncing skaters from staging...", db_name)
+        conn.execute(SYNC_SKATERS)
+
+        logger.info("[%s]   - Syncing goalies from staging...", db_name)
+        conn.execute(SYNC_GOALIES)
+
 
 async def run_etl_for_db(engine, scraper, roster_data, season_data, db_name="primary"):
     """Run the NHL roster ETL process for a single database."""
     start_time = datetime.now()
-    logger.info(f"Starting NHL roster ETL for {db_name} database")
+    logger.info("Starting NHL roster ETL for %s database", db_name)
     
     current_data = roster_data
     skaters_df = season_data['skaters']
     goalies_df = season_data['goalies']
     
     try:
-        # Test the connection
-        logger.info(f"[{db_name}] Testing database connection...")
-        with engine.connect() as connection:
-            logger.info(f"[{db_name}] ✓ Database connection successful!")
-        
         # ========== PIPELINE 1: ROSTERS ==========
-        logger.info(f"[{db_name}] Using {len(current_data)} roster records from scraper")
-        
-        # Step 2: Load existing active rosters from database
-        logger.info(f"[{db_name}] Loading existing active rosters from database...")
-        with engine.connect() as conn:
-            active_rosters = pd.read_sql('SELECT * FROM newapi.rosters_active', conn)
-        logger.info(f"[{db_name}] ✓ Loaded {len(active_rosters)} existing active roster records")
+        logger.info("[%s] Using %d roster records from scraper", db_name, len(current_data))
         
-        # Step 3: Identify new players (call-ups)
-        new_ids = current_data['playerId'].unique().tolist()
-        existing_ids = active_rosters['playerId'].unique().tolist()
-        
-        new_players = current_data[~current_data['playerId'].isin(existing_ids)]
-        logger.info(f"[{db_name}] Found {len(new_players)} new players (call-ups)")
-        if len(new_players) > 0:
-            logger.info(f"[{db_name}] New players: {new_players['playerId'].tolist()}")
-        
-        # Step 4: Identify missing players (send-downs)
-        missing_players = active_rosters[~active_rosters['playerId'].isin(new_ids)]
-        logger.info(f"[{db_name}] Found {len(missing_players)} missing players (send-downs)")
-        if len(missing_players) > 0:
-            logger.info(f"[{db_name}] Missing players: {missing_players['playerId'].tolist()}")
-        
-        # Step 5: Load current data to staging table
-        logger.info(f"[{db_name}] Loading current roster data to staging table...")
+        # Steps 2-4: Stage rosters, diff them against active rosters and sync
+        logger.info("[%s] Staging, diffing and syncing rosters...", db_name)
+        new_ids = current_data['playerId'].unique()
         try:
-            with engine.begin() as conn:
-                current_data.to_sql(
-                    'current_rosters',
-                    conn,
-                    schema='staging1',
-                    if_exists='replace',
-                    index=False
-                )
+            new_players, missing_players = await asyncio.to_thread(
+                sync_rosters, engine, db_name, current_data
+            )
         except SQLAlchemyError:
             # Ensure we don't return a connection to the pool in a broken txn state.
-            logger.exception(f"[{db_name}] Failed loading staging1.current_rosters; transaction rolled back")
+            logger.exception("[%s] Roster staging/sync failed; transaction rolled back", db_name)
             raise
-        logger.info(f"[{db_name}] ✓ Data loaded to staging1.current_rosters")
+        logger.info("[%s] ✓ Roster sync completed", db_name)
+        
+        logger.info("[%s] Found %d new players (call-ups)", db_name, len(new_players))
+        if new_players and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s] New players: %s", db_name, new_players[:MAX_LOGGED_IDS])
         
-        # Step 6: Run stored procedure to sync rosters
-        logger.info(f"[{db_name}] Running sync_rosters_from_staging procedure...")
-        with engine.begin() as conn:
-            conn.execute(text("CALL sync_rosters_from_staging()"))
-        logger.info(f"[{db_name}] ✓ Roster sync completed")
+        logger.info("[%s] Found %d missing players (send-downs)", db_name, len(missing_players))
+        if missing_players and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s] Missing players: %s", db_name, missing_players[:MAX_LOGGED_IDS])
         
-        # Step 7: Scrape detailed player data for new players
+        # Step 5: Scrape detailed player data
         if len(new_ids) > 0:
-            logger.info(f"[{db_name}] Scraping detailed data for {len(new_ids)} players...")
-            await scraper.scrape_all_players(new_ids, engine)
-            logger.info(f"[{db_name}] ✓ Player data scraped and loaded to staging")
-            
-            # Step 8: Sync player data
-            logger.info(f"[{db_name}] Running player sync procedures...")
-            with engine.begin() as conn:
-                logger.info(f"[{db_name}]   - Syncing players...")
-                conn.execute(text("CALL sync_players_from_staging()"))
-
-                logger.info(f"[{db_name}]   - Syncing season skaters...")
-                conn.execute(text("CALL sync_season_skaters_from_staging()"))
-
-                logger.info(f"[{db_name}]   - Syncing season goalies...")
-                conn.execute(text("CALL sync_season_goalies_from_staging()"))
-            logger.info(f"[{db_name}] ✓ All player sync procedures completed")
+            logger.info("[%s] Scraping detailed data for %d players...", db_name, len(new_ids))
+            await scraper.scrape_all_players(new_ids.tolist(), engine)
+            logger.info("[%s] ✓ Player data scraped and loaded to staging", db_name)
         else:
-            logger.info(f"[{db_name}] No new players to scrape detailed data for")
+            logger.info("[%s] No new players to scrape detailed data for", db_name)
         
         # ========== PIPELINE 2: CURRENT SEASON STATS ==========
-        logger.info(f"[{db_name}] Using {len(skaters_df)} skater records and {len(goalies_df)} goalie records from scraper")
+        logger.info("[%s] Using %d skater records and %d goalie records from scraper",
+                    db_name, len(skaters_df), len(goalies_df))
         
-        # Step 10: Load season stats to staging
-        logger.info(f"[{db_name}] Loading season stats to staging tables...")
+        # Steps 6-8: Sync player data, then stage and sync season stats
+        logger.info("[%s] Running player and season stats sync...", db_name)
         try:
-            with engine.begin() as conn:
-                skaters_df.to_sql('skaters', conn, if_exists='replace', index=False, schema='staging1')
-                goalies_df.to_sql('goalies', conn, if_exists='replace', index=False, schema='staging1')
+            await asyncio.to_thread(
+                sync_players_and_season_stats, engine, db_name, skaters_df, goalies_df, len(new_ids) > 0
+            )
         except SQLAlchemyError:
-            logger.exception(f"[{db_name}] Failed loading staging1 skaters/goalies; transaction rolled back")
+            logger.exception("[%s] Player/season stats sync failed; transaction rolled back", db_name)
             raise
-        logger.info(f"[{db_name}] ✓ Skaters and goalies data loaded to staging")
-        
-        # Step 11: Sync season stats
-        logger.info(f"[{db_name}] Running season stats sync procedures...")
-        with engine.begin() as conn:
-            logger.info(f"[{db_name}]   - Syncing skaters from staging...")
-            conn.execute(text("CALL sync_skaters_from_staging()"))
-
-            logger.info(f"[{db_name}]   - Syncing goalies from staging...")
-            conn.execute(text("CALL sync_goalies_from_staging()"))
-        logger.info(f"[{db_name}] ✓ Season stats sync completed")
+        logger.info("[%s] ✓ All sync procedures completed", db_name)
         
         # Success summary
         duration = (datetime.now() - start_time).total_seconds()
         logger.info("="*60)
-        logger.info(f"ETL SUMMARY [{db_name}]")
+        logger.info("ETL SUMMARY [%s]", db_name)
         logger.info("="*60)
-        logger.info(f"Roster records processed: {len(current_data)}")
-        logger.info(f"New call-ups: {len(new_players)}")
-        logger.info(f"Send-downs: {len(missing_players)}")
-        logger.info(f"Season skaters: {len(skaters_df)}")
-        logger.info(f"Season goalies: {len(goalies_df)}")
-        logger.info(f"Duration: {duration:.2f} seconds")
-        logger.info(f"Status: SUCCESS ✓")
+        logger.info("Roster records processed: %d", len(current_data))
+        logger.info("New call-ups: %d", len(new_players))
+        logger.info("Send-downs: %d", len(missing_players))
+        logger.info("Season skaters: %d", len(skaters_df))
+        logger.info("Season goalies: %d", len(goalies_df))
+        logger.info("Duration: %.2f seconds", duration)
+        logger.info("Status: SUCCESS ✓")
         logger.info("="*60)
         
     except Exception as e:
         logger.error("="*60)
-        logger.error(f"ETL FAILED [{db_name}]: {e}")
+        logger.error("ETL FAILED [%s]: %s", db_name, e)
         logger.error("="*60)
         logger.error("Full traceback:", exc_info=True)
         raise
-    
-    finally:
-        engine.dispose()
-        logger.info(f"[{db_name}] Database connection closed")
 
 
 async def main():
@@ -165,45 +312,68 @@ async def main():
     if connection_string_2:
         db_configs.append({"name": "secondary", "connection_string": connection_string_2})
     
-    logger.info(f"Found {len(db_configs)} database connection(s) to process")
-    
-    scraper = NHLScraper()
+    logger.info("Found %d database connection(s) to process", len(db_configs))
     
-    # Scrape all data once upfront
-    logger.info("Scraping roster data from NHL API...")
-    roster_data = await scraper.scrape_all_rosters()
-    logger.info(f"✓ Scraped {len(roster_data)} roster records")
+    # Scrape all data once upfront. The two scrapes are independent, so run
+    # them concurrently, each on its own scraper instance.
+    logger.info("Scraping roster data and current season stats from NHL API...")
+    roster_data, season_data = await asyncio.gather(
+        NHLScraper().scrape_all_rosters(),
+        NHLScraper().scrape_current_season(),
+    )
+    logger.info("✓ Scraped %d roster records", len(roster_data))
+    logger.info("✓ Scraped %d skaters and %d goalies", len(season_data['skaters']), len(season_data['goalies']))
     
-    logger.info("Scraping current season stats from NHL API...")
-    season_data = await scraper.scrape_current_season()
-    logger.info(f"✓ Scraped {len(season_data['skaters'])} skaters and {len(season_data['goalies'])} goalies")
+    # A player can come back from more than one team endpoint; drop repeats once
+    # here so no database has to ingest them.
+    scraped_count = len(roster_data)
+    roster_data = roster_data.drop_duplicates(subset='playerId', ignore_index=True)
+    if len(roster_data) != scraped_count:
+        logger.warning("Dropped %d duplicate roster records by playerId", scraped_count - len(roster_data))
     
-    # Run ETL for each database, tracking successes and failures
-    failed_dbs = []
-    succeeded_dbs = []
+    # Run ETL for each database concurrently, tracking successes and failures.
+    # Each database gets its own scraper so per-player scrapes don't share state.
+    engines = {}
     for db_config in db_configs:
         # Pre-ping reduces failures from stale/closed connections.
         # Recycle helps in environments with aggressive connection timeouts.
-        engine = create_engine(
+        # A small fixed pool keeps warm connections for the whole run.
+        engines[db_config["name"]] = create_engine(
             db_config["connection_string"],
+            pool_size=4,
+            max_overflow=0,
             pool_pre_ping=True,
             pool_recycle=1800,
         )
-        try:
-            await run_etl_for_db(engine, scraper, roster_data, season_data, db_config["name"])
-            succeeded_dbs.append(db_config["name"])
-        except Exception as e:
-            logger.error(f"ETL failed for {db_config['name']} database: {e}. Continuing with remaining databases...")
+    try:
+        results = await asyncio.gather(
+            *(run_etl_for_db(engines[c["name"]], NHLScraper(), roster_data, season_data, c["name"])
+              for c in db_configs),
+            return_exceptions=True,
+        )
+    finally:
+        for name, engine in engines.items():
+            engine.dispose()
+            logger.info("[%s] Database connection closed", name)
+    
+    failed_dbs = []
+    succeeded_dbs = []
+    for db_config, result in zip(db_configs, results):
+        # BaseException so a cancelled pipeline (CancelledError) counts as failed.
+        if isinstance(result, BaseException):
+            logger.error("ETL failed for %s database: %s", db_config['name'], result)
             failed_dbs.append(db_config["name"])
+        else:
+            succeeded_dbs.append(db_config["name"])
     
     # Report overall status
     total = len(db_configs)
     logger.info("="*60)
-    logger.info(f"OVERALL ETL SUMMARY: {len(succeeded_dbs)}/{total} databases succeeded")
+    logger.info("OVERALL ETL SUMMARY: %d/%d databases succeeded", len(succeeded_dbs), total)
     if succeeded_dbs:
-        logger.info(f"Succeeded: {succeeded_dbs}")
+        logger.info("Succeeded: %s", succeeded_dbs)
     if failed_dbs:
-        logger.warning(f"Failed: {failed_dbs}")
+        logger.warning("Failed: %s", failed_dbs)
     logger.info("="*60)
     
     # Only fail if ALL databases failed